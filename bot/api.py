@@ -1,8 +1,55 @@
+import hmac
+import logging
+import uuid
+from contextvars import ContextVar
+
 from aiohttp import web
 
+log = logging.getLogger(__name__)
+
+# ID de corrélation de la requête HTTP en cours (hérité par les tâches qu'elle crée)
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+
+class RequestIdFilter(logging.Filter):
+    """Ajoute request_id aux records de log (à poser sur le handler)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+def auth_middleware(api_key: str):
+    """
+    Vérifie x-admin-lab-key sur toutes les routes sauf /health.
+    Comparaison à temps constant, avant le dispatch vers les handlers.
+    Pose aussi le request_id utilisé dans les logs.
+    """
+    expected = api_key.encode()
+
+    @web.middleware
+    async def middleware(request: web.Request, handler):
+        request_id.set(uuid.uuid4().hex[:12])
+
+        if request.path == "/health":
+            return await handler(request)
+
+        key = request.headers.get("x-admin-lab-key", "")
+        if not hmac.compare_digest(key.encode("utf-8", "surrogateescape"), expected):
+            log.warning("Unauthorized request on %s", request.path)
+            return web.Response(
+                status=401,
+                body=b'{"error":"unauthorized"}',
+                content_type="application/json",
+            )
+        return await handler(request)
+
+    return middleware
+
 async def start_api(app: web.Application, host: str, port: int):
-    runner = web.AppRunner(app)
+    # Pas d'access log : un appel logging + formatage par requête sur le hot path
+    runner = web.AppRunner(app, access_log=None)
     await runner.setup()
-    site = web.TCPSite(runner, host, port)
+    site = web.TCPSite(runner, host, port, backlog=2048, reuse_address=True)
     await site.start()
-    print(f"[HTTP] Listening on {host}:{port}")
+    log.info("Listening on %s:%s", host, port)
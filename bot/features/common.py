@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import re
+from collections.abc import Awaitable, Callable, Hashable
+from dataclasses import dataclass
+from typing import Any
+
+import orjson
+from aiohttp import web
+from cachetools import LRUCache
+
+log = logging.getLogger(__name__)
+
+# Snowflake Discord : entier décimal ASCII de 17 à 20 chiffres, sans zéro initial
+SNOWFLAKE = re.compile(r"\A[1-9][0-9]{16,19}\Z")
+
+# Plafond mémoire quel que soit le nombre de clés distinctes demandées
+CACHE_MAX_ENTRIES = 1024
+
+
+@dataclass(slots=True, frozen=True)
+class CacheEntry:
+    expires_at: float  # loop.time() (monotone)
+    body: bytes
+    etag: str
+
+
+def json_response(payload: dict[str, Any], status: int = 200) -> web.Response:
+    return web.Response(
+        body=orjson.dumps(payload),
+        status=status,
+        content_type="application/json",
+    )
+
+
+def _make_entry(body: bytes, expires_at: float) -> CacheEntry:
+    # Sérialisé une seule fois au build : les cache hits renvoient les bytes tels quels
+    etag = '"%s"' % hashlib.blake2b(body, digest_size=8).hexdigest()
+    return CacheEntry(expires_at=expires_at, body=body, etag=etag)
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    # If-None-Match : liste d'ETags séparés par des virgules, éventuellement
+    # faibles (W/"..."), ou "*" ; comparaison faible (RFC 9110 §13.1.2)
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _cached_response(
+    request: web.Request, entry: CacheEntry, cache_status: str
+) -> web.Response:
+    headers = {"ETag": entry.etag, "X-Cache": cache_status}
+    if _etag_matches(request.headers.get("If-None-Match"), entry.etag):
+        return web.Response(status=304, headers=headers)
+    return web.Response(
+        body=entry.body,
+        content_type="application/json",
+        headers=headers,
+    )
+
+
+class ResponseCache:
+    """
+    Cache des bodies JSON d'une feature, par clé (guild, guild/role, ...).
+
+    - TTL sur l'horloge monotone de la loop + éviction active (call_at)
+    - LRU borné à CACHE_MAX_ENTRIES
+    - Stale-while-revalidate : entrée expirée servie pendant stale_window_seconds
+      pendant qu'un rebuild tourne en arrière-plan
+    - Single-flight : les requêtes concurrentes attendent le même build
+    - Timeout pour ne jamais bloquer indéfiniment (202, le build continue)
+    - ETag / If-None-Match -> 304, header X-Cache: hit|stale|miss
+    """
+
+    def __init__(
+        self,
+        cache_seconds: int = 300,
+        stale_window_seconds: int = 300,
+        build_timeout_seconds: int = 25,
+    ):
+        self.cache_seconds = max(10, int(cache_seconds))
+        self.stale_window_seconds = max(0, int(stale_window_seconds))
+        self.build_timeout_seconds = max(5, int(build_timeout_seconds))
+
+        self._cache: LRUCache[Hashable, CacheEntry] = LRUCache(maxsize=CACHE_MAX_ENTRIES)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._inflight: dict[Hashable, asyncio.Task] = {}
+
+    def pop(self, key: Hashable) -> CacheEntry | None:
+        # Build en cours détaché : son body, calculé avant l'invalidation,
+        # ne sera pas stocké (la requête suivante relance un build)
+        self._inflight.pop(key, None)
+        return self._cache.pop(key, None)
+
+    def _store(self, key: Hashable, body: bytes) -> CacheEntry:
+        entry = _make_entry(body, expires_at=self._loop.time() + self.cache_seconds)
+        self._cache[key] = entry
+        # Éviction active : sinon les clés jamais redemandées restent en mémoire.
+        # Le timer ne garde que (key, expires_at) : une entrée remplacée entre-temps
+        # (rebuild, invalidation, LRU) est libérée tout de suite, pas à l'échéance.
+        self._loop.call_at(
+            entry.expires_at + self.stale_window_seconds + 1,
+            self._evict,
+            key,
+            entry.expires_at,
+        )
+        return entry
+
+    def _evict(self, key: Hashable, expires_at: float):
+        # Ne supprime pas une entrée plus récente stockée entre-temps
+        entry = self._cache.get(key)
+        if entry is not None and entry.expires_at == expires_at:
+            del self._cache[key]
+
+    async def _build_entry(
+        self, key: Hashable, build: Callable[[], Awaitable[bytes]]
+    ) -> CacheEntry:
+        task = asyncio.current_task()
+        try:
+            body = await build()
+            if self._inflight.get(key) is not task:
+                # Invalidé pendant le build : servi aux appelants déjà en attente,
+                # mais pas mis en cache
+                return _make_entry(body, expires_at=self._loop.time())
+            return self._store(key, body)
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    def _get_build(self, key: Hashable, build: Callable[[], Awaitable[bytes]]) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._build_entry(key, build))
+            task.add_done_callback(self._on_build_done)
+            self._inflight[key] = task
+        return task
+
+    def _on_build_done(self, task: asyncio.Task):
+        # Refresh en arrière-plan : personne n'attend forcément le résultat,
+        # on consomme l'exception pour éviter "Task exception was never retrieved".
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc is not None and not isinstance(exc, web.HTTPException):
+            log.error("Cache build failed", exc_info=exc)
+
+    async def respond(
+        self,
+        request: web.Request,
+        key: Hashable,
+        build: Callable[[], Awaitable[bytes]],
+        building_payload: dict[str, Any],
+    ) -> web.Response:
+        if self._loop is None:
+            self._loop = asyncio.get_running_loop()
+
+        entry = self._cache.get(key)
+        if entry:
+            now = self._loop.time()
+            # Cache hit
+            if now < entry.expires_at:
+                return _cached_response(request, entry, "hit")
+            # Stale-while-revalidate : réponse immédiate, rebuild en arrière-plan
+            if now < entry.expires_at + self.stale_window_seconds:
+                self._get_build(key, build)
+                return _cached_response(request, entry, "stale")
+
+        task = self._get_build(key, build)
+        try:
+            # shield() => le timeout n'annule pas le build, il remplira le cache
+            async with asyncio.timeout(self.build_timeout_seconds):
+                entry = await asyncio.shield(task)
+        except TimeoutError:
+            # On renvoie un 202 "building_cache" au lieu de bloquer.
+            # La requête suivante réessaiera.
+            return json_response({"status": "building_cache", **building_payload}, status=202)
+        except web.HTTPException as exc:
+            # Même instance pour tous les appelants du build partagé : une HTTPException
+            # est une Response, déjà envoyée à la première requête (prepare() ne fait
+            # plus rien ensuite). Chaque requête lève donc sa propre copie.
+            raise type(exc)(
+                reason=exc.reason, body=exc.body, content_type=exc.content_type
+            ) from exc
+        return _cached_response(request, entry, "miss")
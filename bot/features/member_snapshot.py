@@ -0,0 +1,232 @@
+import asyncio
+import functools
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import discord
+import orjson
+from aiohttp import web
+from discord.ext import commands
+
+
+@dataclass(slots=True, frozen=True)
+class MemberLite:
+    id: int
+    name: str
+    display_name: str
+    role_ids: frozenset[int]
+    premium_since: datetime | None
+
+
+@dataclass(slots=True)
+class GuildMemberSnapshot:
+    expires_at: float  # loop.time() (monotone)
+    by_id: dict[int, MemberLite]
+    # role_id -> IDs des membres ayant le rôle (construit une fois par snapshot)
+    role_index: dict[int, list[int]]
+
+
+@dataclass(slots=True)
+class _PendingEvents:
+    # Events gateway reçus pendant un build, rejoués sur le nouveau snapshot
+    members: dict[int, MemberLite | None] = field(default_factory=dict)
+    deleted_roles: set[int] = field(default_factory=set)
+
+
+def _to_lite(member: discord.Member) -> MemberLite:
+    return MemberLite(
+        id=member.id,
+        name=member.name,
+        display_name=member.display_name,
+        # member.roles contient toujours @everyone + rôles si dispo
+        role_ids=frozenset(r.id for r in member.roles),
+        premium_since=member.premium_since,
+    )
+
+
+def _index_members(
+    members: list[discord.Member],
+) -> tuple[dict[int, MemberLite], dict[int, list[int]]]:
+    # Conversion + index en thread : member.roles résout/trie les Role à chaque
+    # appel, c'est le gros du coût CPU sur une grosse guild.
+    by_id = {m.id: _to_lite(m) for m in members}
+
+    role_index: dict[int, list[int]] = {}
+    for m in by_id.values():
+        for rid in m.role_ids:
+            role_index.setdefault(rid, []).append(m.id)
+    return by_id, role_index
+
+
+class MemberSnapshotCache:
+    """
+    Snapshot des membres d'une guild, partagé entre les features
+    (/role-members, /boosters) : un seul scan par guild et par TTL.
+
+    - Chunk gateway (guild.chunk) : nécessite l'intent members
+      (sinon 503 members_intent_disabled, guild.fetch_members l'exige aussi)
+    - Single-flight : les appels concurrents sur la même guild
+      attendent le même build
+    - Events gateway (member update/join/remove, user update, role delete) : snapshot
+      patché en place (rejoués à la fin d'un build en cours), le TTL ne sert plus
+      que de filet de sécurité
+    """
+
+    def __init__(self, bot: commands.Bot, executor: Executor, cache_seconds: int = 300):
+        self.bot = bot
+        self.executor = executor
+        self.cache_seconds = max(10, int(cache_seconds))
+
+        self._cache: dict[int, GuildMemberSnapshot] = {}
+        self._inflight: dict[int, asyncio.Task] = {}
+        self._pending: dict[int, _PendingEvents] = {}
+
+        bot.add_listener(self._on_member_update, "on_member_update")
+        bot.add_listener(self._on_member_join, "on_member_join")
+        bot.add_listener(self._on_member_remove, "on_member_remove")
+        bot.add_listener(self._on_guild_role_delete, "on_guild_role_delete")
+        bot.add_listener(self._on_user_update, "on_user_update")
+
+    def _cache_valid(self, entry: GuildMemberSnapshot) -> bool:
+        return entry.expires_at > asyncio.get_running_loop().time()
+
+    def _evict(self, guild_id: int, expires_at: float):
+        # Ne supprime pas un snapshot plus récent stocké entre-temps
+        entry = self._cache.get(guild_id)
+        if entry is not None and entry.expires_at == expires_at:
+            del self._cache[guild_id]
+
+    async def _build(self, guild: discord.Guild) -> GuildMemberSnapshot:
+        # Chunk gateway (op 8 REQUEST_GUILD_MEMBERS) : budget par shard,
+        # bien plus rapide que la pagination REST sur les grosses guilds.
+        if not guild.chunked:
+            await guild.chunk(cache=True)
+
+        # Copie de la liste sur l'event loop, conversion hors de l'event loop
+        loop = asyncio.get_running_loop()
+        by_id, role_index = await loop.run_in_executor(
+            self.executor, _index_members, list(guild.members)
+        )
+
+        snapshot = GuildMemberSnapshot(
+            expires_at=loop.time() + self.cache_seconds,
+            by_id=by_id,
+            role_index=role_index,
+        )
+        if self._inflight.get(guild.id) is not asyncio.current_task():
+            # Invalidé pendant le build : rendu aux appelants en attente, pas mis en cache
+            return snapshot
+
+        self._cache[guild.id] = snapshot
+        # Events reçus pendant le chunk / la conversion : la liste des membres a pu
+        # être copiée (ou convertie) avant eux, on les rejoue sur le nouveau snapshot.
+        pending = self._pending.pop(guild.id, None)
+        if pending is not None:
+            for member_id, new in pending.members.items():
+                self._patch(guild.id, member_id, new)
+            for role_id in pending.deleted_roles:
+                snapshot.role_index.pop(role_id, None)
+        # Éviction active : libère la liste des membres dès l'expiration
+        # (le timer ne référence pas le snapshot, un snapshot remplacé est libéré)
+        loop.call_at(snapshot.expires_at + 1, self._evict, guild.id, snapshot.expires_at)
+        return snapshot
+
+    def _patch(self, guild_id: int, member_id: int, new: MemberLite | None):
+        pending = self._pending.get(guild_id)
+        if pending is not None:
+            # Build en cours : dernier état du membre, rejoué à la fin du build
+            pending.members[member_id] = new
+
+        snapshot = self._cache.get(guild_id)
+        if snapshot is None:
+            return
+
+        # Le snapshot peut être lu en parallèle par l'executor (filtre/sérialisation) :
+        # on ne modifie jamais la taille d'un dict/d'une liste en cours de lecture,
+        # on remplace l'objet (copy-on-write).
+        old = snapshot.by_id.get(member_id)
+        if old is not None and new is not None:
+            snapshot.by_id[member_id] = new
+        else:
+            by_id = dict(snapshot.by_id)
+            if new is None:
+                by_id.pop(member_id, None)
+            else:
+                by_id[member_id] = new
+            snapshot.by_id = by_id
+
+        old_roles = old.role_ids if old is not None else frozenset()
+        new_roles = new.role_ids if new is not None else frozenset()
+        index = snapshot.role_index
+        for rid in new_roles - old_roles:
+            index[rid] = [*index.get(rid, ()), member_id]
+        for rid in old_roles - new_roles:
+            index[rid] = [mid for mid in index.get(rid, ()) if mid != member_id]
+
+    async def _on_member_update(self, before: discord.Member, after: discord.Member):
+        self._patch(after.guild.id, after.id, _to_lite(after))
+
+    async def _on_member_join(self, member: discord.Member):
+        self._patch(member.guild.id, member.id, _to_lite(member))
+
+    async def _on_member_remove(self, member: discord.Member):
+        self._patch(member.guild.id, member.id, None)
+
+    async def _on_user_update(self, before: discord.User, after: discord.User):
+        # Changement de username / nom global : pas de on_member_update,
+        # on patche le membre dans chaque guild commune.
+        for guild in after.mutual_guilds:
+            member = guild.get_member(after.id)
+            if member is not None:
+                self._patch(guild.id, member.id, _to_lite(member))
+
+    async def _on_guild_role_delete(self, role: discord.Role):
+        pending = self._pending.get(role.guild.id)
+        if pending is not None:
+            pending.deleted_roles.add(role.id)
+        snapshot = self._cache.get(role.guild.id)
+        if snapshot is not None:
+            snapshot.role_index.pop(role.id, None)
+
+    def peek(self, guild_id: int) -> GuildMemberSnapshot | None:
+        # Snapshot en cache encore valide, sans jamais déclencher de build
+        entry = self._cache.get(guild_id)
+        if entry and self._cache_valid(entry):
+            return entry
+        return None
+
+    def invalidate(self, guild_id: int):
+        # Build en cours détaché : la requête suivante repart d'un chunk complet
+        self._inflight.pop(guild_id, None)
+        self._pending.pop(guild_id, None)
+        self._cache.pop(guild_id, None)
+
+    def _on_build_done(self, guild_id: int, task: asyncio.Task):
+        if self._inflight.get(guild_id) is task:
+            del self._inflight[guild_id]
+            self._pending.pop(guild_id, None)
+
+    async def get(self, guild: discord.Guild) -> GuildMemberSnapshot:
+        entry = self.peek(guild.id)
+        if entry is not None:
+            return entry
+
+        # Sans l'intent members, ni guild.chunk() ni guild.fetch_members()
+        # ne sont utilisables : on échoue tout de suite avec une erreur explicite.
+        if not self.bot.intents.members:
+            raise web.HTTPServiceUnavailable(
+                body=orjson.dumps({"error": "members_intent_disabled"}),
+                content_type="application/json",
+            )
+
+        task = self._inflight.get(guild.id)
+        if task is None:
+            task = asyncio.create_task(self._build(guild))
+            self._inflight[guild.id] = task
+            self._pending[guild.id] = _PendingEvents()
+            task.add_done_callback(functools.partial(self._on_build_done, guild.id))
+
+        # shield() => un timeout côté appelant n'annule pas le build
+        # pour les autres appelants (le cache sera prêt pour la requête suivante).
+        return await asyncio.shield(task)
@@ -1,17 +1,60 @@
 import asyncio
-import json
-import time
-from dataclasses import dataclass
-from typing import Any
+from concurrent.futures import Executor
 
+import discord
+import orjson
 from aiohttp import web
 from discord.ext import commands
 
-
-@dataclass
-class CacheEntry:
-    ts: float
-    payload: dict
+from .common import SNOWFLAKE, ResponseCache, json_response
+from .member_snapshot import GuildMemberSnapshot, MemberSnapshotCache
+
+
+def _serialize(
+    guild_id: int,
+    guild_name: str,
+    role_id: int,
+    role_name: str,
+    member_ids: list[int],
+) -> bytes:
+    head = orjson.dumps(
+        {
+            "guild_id": str(guild_id),
+            "guild_name": guild_name,
+            "role_id": str(role_id),
+            "role_name": role_name,
+            "count": len(member_ids),
+        }
+    )
+    # "members" écrit directement en bytes (pas de dict par membre ni de
+    # 2e passe de sérialisation) : head[:-1] retire le "}" final de l'en-tête.
+    return b"".join(
+        (
+            head[:-1],
+            b',"members":[',
+            b",".join(b'{"discord_user_id":"%d"}' % mid for mid in member_ids),
+            b"]}",
+        )
+    )
+
+
+def _filter_and_serialize(
+    snapshot: GuildMemberSnapshot,
+    guild_id: int,
+    guild_name: str,
+    role_id: int,
+    role_name: str,
+) -> bytes:
+    # Index role_id -> membres pré-calculé dans le snapshot : lookup O(1)
+    member_ids = snapshot.role_index.get(role_id, [])
+    return _serialize(guild_id, guild_name, role_id, role_name, member_ids)
+
+
+def _serialize_role_members(guild_id: int, guild_name: str, role: discord.Role) -> bytes:
+    # role.members filtre le cache membres de discord.py (copie des valeurs
+    # du dict faite en C, sans rendre le GIL : sûr depuis un thread)
+    member_ids = [m.id for m in role.members]
+    return _serialize(guild_id, guild_name, role.id, role.name, member_ids)
 
 
 class RoleMembersFeature:
@@ -19,155 +62,150 @@ class RoleMembersFeature:
     GET /role-members?guild_id=...&role_id=...
     -> renvoie uniquement des IDs de membres ayant le rôle
 
-    - Pas de guild.chunk() (peut bloquer)
-    - Scan via REST: guild.fetch_members(limit=None)
-    - Cache TTL + lock (1 seul scan à la fois par guild/role)
-    - Timeout pour ne jamais bloquer indéfiniment
+    - Membres lus depuis le MemberSnapshotCache partagé (1 scan par guild)
+    - Cache ResponseCache (TTL, stale-while-revalidate, single-flight, 202)
+
+    Les events gateway (rôles modifiés, join/remove, rôle supprimé) invalident
+    uniquement les clés (guild, role) concernées ; le TTL reste un filet de sécurité.
+
+    POST /role-members/invalidate?guild_id=...&role_id=...
+    -> force un rebuild complet (snapshot membres inclus) à la prochaine requête
     """
 
     def __init__(
         self,
         bot: commands.Bot,
-        api_key: str,
+        snapshots: MemberSnapshotCache,
+        executor: Executor,
         cache_seconds: int = 300,
+        stale_window_seconds: int = 300,
         build_timeout_seconds: int = 25,
     ):
         self.bot = bot
-        self.api_key = api_key
-        self.cache_seconds = max(10, int(cache_seconds))
-        self.build_timeout_seconds = max(5, int(build_timeout_seconds))
-
-        self._cache: dict[tuple[int, int], CacheEntry] = {}
-        self._locks: dict[tuple[int, int], asyncio.Lock] = {}
-
-    def _auth(self, request: web.Request):
-        key = request.headers.get("x-admin-lab-key", "")
-        if key != self.api_key:
-            raise web.HTTPUnauthorized(
-                text=json.dumps({"error": "unauthorized"}),
-                content_type="application/json",
-            )
+        self.snapshots = snapshots
+        self.executor = executor
 
-    def _get_lock(self, cache_key: tuple[int, int]) -> asyncio.Lock:
-        lock = self._locks.get(cache_key)
-        if lock is None:
-            lock = asyncio.Lock()
-            self._locks[cache_key] = lock
-        return lock
+        self._cache = ResponseCache(
+            cache_seconds=cache_seconds,
+            stale_window_seconds=stale_window_seconds,
+            build_timeout_seconds=build_timeout_seconds,
+        )
 
-    def _cache_valid(self, entry: CacheEntry) -> bool:
-        return (time.time() - entry.ts) < self.cache_seconds
+        bot.add_listener(self._on_member_update, "on_member_update")
+        bot.add_listener(self._on_member_join, "on_member_join")
+        bot.add_listener(self._on_member_remove, "on_member_remove")
+        bot.add_listener(self._on_guild_role_delete, "on_guild_role_delete")
 
-    async def _build_payload(self, guild_id: int, role_id: int) -> dict[str, Any]:
+    async def _build_body(self, guild_id: int, role_id: int) -> bytes:
         guild = self.bot.get_guild(guild_id)
         if guild is None:
             raise web.HTTPNotFound(
-                text=json.dumps({"error": "guild_not_found_or_no_access"}),
+                body=orjson.dumps({"error": "guild_not_found_or_no_access"}),
                 content_type="application/json",
             )
 
-        # IMPORTANT :
-        # fetch_members utilise l’API REST, pas le cache gateway.
-        # Il faut quand même que ton bot ait la permission "Server Members Intent"
-        # activée dans le Dev Portal (sinon discord peut limiter).
-        member_ids: list[str] = []
-
-        # Scan de tous les membres, mais avec timeout global (sinon ça peut durer trop)
-        async def _scan():
-            async for member in guild.fetch_members(limit=None):
-                # member.roles contient toujours @everyone + rôles si dispo
-                if any(r.id == role_id for r in member.roles):
-                    member_ids.append(str(member.id))
-
-        try:
-            await asyncio.wait_for(_scan(), timeout=self.build_timeout_seconds)
-        except asyncio.TimeoutError:
-            # On renvoie un 202 "building_cache" au lieu de bloquer.
-            # La requête suivante réessaiera.
-            raise web.HTTPAccepted(
-                text=json.dumps(
-                    {
-                        "status": "building_cache",
-                        "guild_id": str(guild_id),
-                        "role_id": str(role_id),
-                    }
-                ),
-                content_type="application/json",
-            )
-
-        # Nom du rôle : on tente via cache local (sans chunk), sinon "unknown"
-        role_name = "unknown"
+        loop = asyncio.get_running_loop()
         role = guild.get_role(role_id)
-        if role is not None:
-            role_name = role.name
 
-        payload = {
-            "guild_id": str(guild.id),
-            "guild_name": guild.name,
-            "role_id": str(role_id),
-            "role_name": role_name,
-            "count": len(member_ids),
-            "members": [{"discord_user_id": mid} for mid in member_ids],
-        }
-        return payload
+        # Guild déjà chunkée et pas de snapshot en cache : le cache membres de
+        # discord.py est complet et à jour, role.members évite de construire
+        # tout le snapshot pour une seule requête de rôle.
+        # (role.members parcourt quand même toute la guild : quand un snapshot
+        # existe, son role_index reste plus rapide.)
+        if role is not None and guild.chunked and self.snapshots.peek(guild.id) is None:
+            return await loop.run_in_executor(
+                self.executor, _serialize_role_members, guild.id, guild.name, role
+            )
 
-    async def handler(self, request: web.Request):
-        self._auth(request)
+        # Snapshot partagé avec /boosters
+        snapshot = await self.snapshots.get(guild)
 
-        gid = request.query.get("guild_id", "").strip()
-        rid = request.query.get("role_id", "").strip()
+        # Nom du rôle : on tente via cache local (sans chunk), sinon "unknown"
+        role_name = role.name if role is not None else "unknown"
+
+        # Filtre + sérialisation hors de l'event loop (heartbeats gateway, autres requêtes)
+        return await loop.run_in_executor(
+            self.executor,
+            _filter_and_serialize,
+            snapshot,
+            guild.id,
+            guild.name,
+            role_id,
+            role_name,
+        )
+
+    def _parse_ids(self, request: web.Request) -> tuple[int, int]:
+        gid = request.query.get("guild_id", "")
+        rid = request.query.get("role_id", "")
 
         if not gid:
             raise web.HTTPBadRequest(
-                text=json.dumps({"error": "missing guild_id"}),
+                body=orjson.dumps({"error": "missing guild_id"}),
                 content_type="application/json",
             )
         if not rid:
             raise web.HTTPBadRequest(
-                text=json.dumps({"error": "missing role_id"}),
+                body=orjson.dumps({"error": "missing role_id"}),
                 content_type="application/json",
             )
 
-        try:
-            guild_id = int(gid)
-            role_id = int(rid)
-        except ValueError:
+        if not SNOWFLAKE.match(gid) or not SNOWFLAKE.match(rid):
             raise web.HTTPBadRequest(
-                text=json.dumps({"error": "invalid guild_id_or_role_id"}),
+                body=orjson.dumps({"error": "invalid guild_id_or_role_id"}),
                 content_type="application/json",
             )
+        return int(gid), int(rid)
+
+    async def handler(self, request: web.Request):
+        guild_id, role_id = self._parse_ids(request)
 
-        cache_key = (guild_id, role_id)
-
-        # Cache hit
-        entry = self._cache.get(cache_key)
-        if entry and self._cache_valid(entry):
-            return web.json_response(entry.payload)
-
-        # 1 seul build à la fois par (guild, role)
-        lock = self._get_lock(cache_key)
-        if lock.locked():
-            # quelqu’un est déjà en train de construire => 202 immédiat
-            raise web.HTTPAccepted(
-                text=json.dumps(
-                    {
-                        "status": "building_cache",
-                        "guild_id": str(guild_id),
-                        "role_id": str(role_id),
-                    }
-                ),
+        # Guild/rôle inconnus rejetés avant toute entrée de cache ou build
+        guild = self.bot.get_guild(guild_id)
+        if guild is None:
+            raise web.HTTPNotFound(
+                body=orjson.dumps({"error": "guild_not_found_or_no_access"}),
                 content_type="application/json",
             )
+        if guild.get_role(role_id) is None:
+            raise web.HTTPNotFound(
+                body=orjson.dumps({"error": "role_not_found"}),
+                content_type="application/json",
+            )
+
+        return await self._cache.respond(
+            request,
+            (guild_id, role_id),
+            lambda: self._build_body(guild_id, role_id),
+            {"guild_id": str(guild_id), "role_id": str(role_id)},
+        )
+
+    async def invalidate(self, request: web.Request):
+        guild_id, role_id = self._parse_ids(request)
+        invalidated = self._cache.pop((guild_id, role_id)) is not None
+        # Sinon le rebuild repartirait du même snapshot (potentiellement périmé)
+        self.snapshots.invalidate(guild_id)
+
+        return json_response({"ok": True, "invalidated": invalidated})
+
+    def _invalidate_roles(self, guild_id: int, role_ids: set[int]):
+        for rid in role_ids:
+            self._cache.pop((guild_id, rid))
+
+    async def _on_member_update(self, before: discord.Member, after: discord.Member):
+        before_ids = {r.id for r in before.roles}
+        after_ids = {r.id for r in after.roles}
+        # ^ = rôles ajoutés | rôles retirés
+        self._invalidate_roles(after.guild.id, before_ids ^ after_ids)
+
+    async def _on_member_join(self, member: discord.Member):
+        self._invalidate_roles(member.guild.id, {r.id for r in member.roles})
 
-        async with lock:
-            # Re-check cache (une autre requête a pu le remplir juste avant nous)
-            entry2 = self._cache.get(cache_key)
-            if entry2 and self._cache_valid(entry2):
-                return web.json_response(entry2.payload)
+    async def _on_member_remove(self, member: discord.Member):
+        self._invalidate_roles(member.guild.id, {r.id for r in member.roles})
 
-            payload = await self._build_payload(guild_id, role_id)
-            self._cache[cache_key] = CacheEntry(ts=time.time(), payload=payload)
-            return web.json_response(payload)
+    async def _on_guild_role_delete(self, role: discord.Role):
+        self._cache.pop((role.guild.id, role.id))
 
     def register_routes(self, app: web.Application):
         app.router.add_get("/role-members", self.handler)
+        app.router.add_post("/role-members/invalidate", self.invalidate)
@@ -1,17 +1,41 @@
 import asyncio
-import json
-import time
-from dataclasses import dataclass
+from concurrent.futures import Executor
 from typing import Any
 
+import discord
+import orjson
 from aiohttp import web
 from discord.ext import commands
 
-
-@dataclass
-class CacheEntry:
-    ts: float
-    payload: dict
+from .common import SNOWFLAKE, ResponseCache, json_response
+from .member_snapshot import GuildMemberSnapshot, MemberSnapshotCache
+
+
+def _filter_and_serialize(
+    snapshot: GuildMemberSnapshot,
+    guild_id: int,
+    guild_name: str,
+) -> bytes:
+    boosters: list[dict[str, Any]] = [
+        {
+            "discord_user_id": str(m.id),
+            "username": m.name,
+            "display_name": m.display_name,
+            # datetime sérialisé en ISO 8601 directement par orjson
+            "premium_since": m.premium_since,
+        }
+        for m in snapshot.by_id.values()
+        if m.premium_since is not None
+    ]
+
+    return orjson.dumps(
+        {
+            "guild_id": str(guild_id),
+            "guild_name": guild_name,
+            "count": len(boosters),
+            "boosters": boosters,
+        }
+    )
 
 
 class SubscriptionFeature:
@@ -19,126 +43,104 @@ class SubscriptionFeature:
     GET /boosters?guild_id=...
     -> liste des boosters (premium_since)
 
-    - Pas de guild.chunk()
-    - Scan via REST guild.fetch_members(limit=None)
-    - Cache TTL + lock + timeout
+    - Membres lus depuis le MemberSnapshotCache partagé (1 scan par guild)
+    - Cache ResponseCache (TTL, stale-while-revalidate, single-flight, 202)
+    - Invalidation sur les events gateway (boost, départ ou renommage d'un booster)
     """
 
     def __init__(
         self,
         bot: commands.Bot,
-        api_key: str,
+        snapshots: MemberSnapshotCache,
+        executor: Executor,
         cache_seconds: int = 300,
+        stale_window_seconds: int = 300,
         build_timeout_seconds: int = 25,
     ):
         self.bot = bot
-        self.api_key = api_key
-        self.cache_seconds = max(10, int(cache_seconds))
-        self.build_timeout_seconds = max(5, int(build_timeout_seconds))
-
-        self._cache: dict[int, CacheEntry] = {}
-        self._locks: dict[int, asyncio.Lock] = {}
-
-    def _auth(self, request: web.Request):
-        key = request.headers.get("x-admin-lab-key", "")
-        if key != self.api_key:
-            raise web.HTTPUnauthorized(
-                text=json.dumps({"error": "unauthorized"}),
-                content_type="application/json",
-            )
+        self.snapshots = snapshots
+        self.executor = executor
 
-    def _get_lock(self, guild_id: int) -> asyncio.Lock:
-        lock = self._locks.get(guild_id)
-        if lock is None:
-            lock = asyncio.Lock()
-            self._locks[guild_id] = lock
-        return lock
+        self._cache = ResponseCache(
+            cache_seconds=cache_seconds,
+            stale_window_seconds=stale_window_seconds,
+            build_timeout_seconds=build_timeout_seconds,
+        )
 
-    def _cache_valid(self, entry: CacheEntry) -> bool:
-        return (time.time() - entry.ts) < self.cache_seconds
+        bot.add_listener(self._on_member_update, "on_member_update")
+        bot.add_listener(self._on_member_remove, "on_member_remove")
+        bot.add_listener(self._on_user_update, "on_user_update")
 
-    async def _build_payload(self, guild_id: int) -> dict[str, Any]:
+    async def _build_body(self, guild_id: int) -> bytes:
         guild = self.bot.get_guild(guild_id)
         if guild is None:
             raise web.HTTPNotFound(
-                text=json.dumps({"error": "guild_not_found_or_no_access"}),
+                body=orjson.dumps({"error": "guild_not_found_or_no_access"}),
                 content_type="application/json",
             )
 
-        boosters: list[dict[str, Any]] = []
-
-        async def _scan():
-            async for m in guild.fetch_members(limit=None):
-                if m.premium_since:
-                    boosters.append(
-                        {
-                            "discord_user_id": str(m.id),
-                            "username": m.name,
-                            "display_name": m.display_name,
-                            "premium_since": m.premium_since.isoformat(),
-                        }
-                    )
-
-        try:
-            await asyncio.wait_for(_scan(), timeout=self.build_timeout_seconds)
-        except asyncio.TimeoutError:
-            raise web.HTTPAccepted(
-                text=json.dumps(
-                    {
-                        "status": "building_cache",
-                        "guild_id": str(guild_id),
-                    }
-                ),
-                content_type="application/json",
-            )
-
-        return {
-            "guild_id": str(guild.id),
-            "guild_name": guild.name,
-            "count": len(boosters),
-            "boosters": boosters,
-        }
+        snapshot = await self.snapshots.get(guild)
+
+        # Filtre + sérialisation hors de l'event loop (heartbeats gateway, autres requêtes)
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor,
+            _filter_and_serialize,
+            snapshot,
+            guild.id,
+            guild.name,
+        )
+
+    async def _on_member_update(self, before: discord.Member, after: discord.Member):
+        renamed = (before.name, before.display_name) != (after.name, after.display_name)
+        if before.premium_since != after.premium_since or (
+            after.premium_since is not None and renamed
+        ):
+            self._cache.pop(after.guild.id)
+
+    async def _on_user_update(self, before: discord.User, after: discord.User):
+        if (before.name, before.display_name) == (after.name, after.display_name):
+            return
+        # username / display_name d'un booster présent dans le body en cache
+        for guild in after.mutual_guilds:
+            member = guild.get_member(after.id)
+            if member is not None and member.premium_since is not None:
+                self._cache.pop(guild.id)
+
+    async def _on_member_remove(self, member: discord.Member):
+        if member.premium_since is not None:
+            self._cache.pop(member.guild.id)
 
     def register_routes(self, app: web.Application):
         app.router.add_get("/health", self.health)
         app.router.add_get("/boosters", self.boosters)
 
     async def health(self, request: web.Request):
-        return web.json_response({"ok": True})
+        return json_response({"ok": True})
 
     async def boosters(self, request: web.Request):
-        self._auth(request)
-
-        gid = request.query.get("guild_id", "").strip()
+        gid = request.query.get("guild_id", "")
         if not gid:
             raise web.HTTPBadRequest(
-                text=json.dumps({"error": "missing guild_id"}),
+                body=orjson.dumps({"error": "missing guild_id"}),
                 content_type="application/json",
             )
-        try:
-            guild_id = int(gid)
-        except ValueError:
+        if not SNOWFLAKE.match(gid):
             raise web.HTTPBadRequest(
-                text=json.dumps({"error": "invalid guild_id"}),
+                body=orjson.dumps({"error": "invalid guild_id"}),
                 content_type="application/json",
             )
+        guild_id = int(gid)
 
-        entry = self._cache.get(guild_id)
-        if entry and self._cache_valid(entry):
-            return web.json_response(entry.payload)
-
-        lock = self._get_lock(guild_id)
-        if lock.locked():
-            raise web.HTTPAccepted(
-                text=json.dumps({"status": "building_cache", "guild_id": str(guild_id)}),
+        # Guild inconnue rejetée avant toute entrée de cache ou build
+        if self.bot.get_guild(guild_id) is None:
+            raise web.HTTPNotFound(
+                body=orjson.dumps({"error": "guild_not_found_or_no_access"}),
                 content_type="application/json",
             )
 
-        async with lock:
-            entry2 = self._cache.get(guild_id)
-            if entry2 and self._cache_valid(entry2):
-                return web.json_response(entry2.payload)
-
-            payload = await self._build_payload(guild_id)
-            self._cache[guild_id] = CacheEntry(ts=time.time(), payload=payload)
-            return web.json_response(payload)
+        return await self._cache.respond(
+            request,
+            guild_id,
+            lambda: self._build_body(guild_id),
+            {"guild_id": str(guild_id)},
+        )
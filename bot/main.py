@@ -1,29 +1,85 @@
 import asyncio
+import atexit
+import logging
+import logging.handlers
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
 from aiohttp import web
 
+try:
+    import uvloop
+except ImportError:  # Windows : pas de uvloop, boucle asyncio standard
+    uvloop = None
+
 from .settings import load_settings
 from .discord_client import build_bot
-from .api import start_api
+from .api import RequestIdFilter, auth_middleware, start_api
+from .features.member_snapshot import MemberSnapshotCache
 from .features.subscriptions import SubscriptionFeature
 from .features.role_members import RoleMembersFeature
 
+log = logging.getLogger(__name__)
+
+
+def setup_logging():
+    # Les handlers n'écrivent que dans une queue : l'écriture sur stdout/stderr
+    # (potentiellement lente) se fait dans le thread du QueueListener,
+    # jamais dans l'event loop.
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s]: %(message)s")
+    )
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Filtre sur le handler (pas le logger) : s'applique aussi aux logs de discord.py,
+    # et lit le ContextVar dans le contexte de l'appelant, avant la mise en queue.
+    queue_handler.addFilter(RequestIdFilter())
+    root.addHandler(queue_handler)
+
+
 async def main():
     settings = load_settings()
     bot = build_bot()
 
-    app = web.Application()
+    # Uniquement des petits GET/POST sans body : on refuse tout body > 64 Ko sans le bufferiser
+    app = web.Application(
+        middlewares=[auth_middleware(settings.admin_lab_api_key)],
+        client_max_size=64 * 1024,
+    )
+
+    # Construction des snapshots + filtre/sérialisation JSON, hors de l'event loop
+    executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="filter")
+
+    # Snapshot des membres partagé : 1 seul scan par guild pour toutes les features
+    snapshots = MemberSnapshotCache(
+        bot=bot,
+        executor=executor,
+        cache_seconds=settings.members_cache_seconds,
+    )
 
     subs = SubscriptionFeature(
         bot=bot,
-        api_key=settings.admin_lab_api_key,
+        snapshots=snapshots,
+        executor=executor,
         cache_seconds=settings.boosters_cache_seconds,
+        stale_window_seconds=settings.cache_stale_seconds,
     )
     subs.register_routes(app)
 
     role_members = RoleMembersFeature(
         bot=bot,
-        api_key=settings.admin_lab_api_key,
+        snapshots=snapshots,
+        executor=executor,
         cache_seconds=settings.role_members_cache_seconds,
+        stale_window_seconds=settings.cache_stale_seconds,
     )
     role_members.register_routes(app)
 
@@ -32,13 +88,21 @@ async def main():
     @bot.event
     async def on_ready():
         nonlocal api_started
-        print(f"[DISCORD] Logged in as {bot.user} (id={bot.user.id})")
+        log.info("Logged in as %s (id=%s)", bot.user, bot.user.id)
 
         if not api_started:
             api_started = True
             bot.loop.create_task(start_api(app, settings.http_host, settings.http_port))
 
-    await bot.start(settings.discord_bot_token)
+    try:
+        await bot.start(settings.discord_bot_token)
+    finally:
+        executor.shutdown(wait=True)
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    setup_logging()
+    if uvloop is not None:
+        # Boucle libuv : moins d'overhead par syscall pour aiohttp + gateway discord
+        uvloop.run(main())
+    else:
+        asyncio.run(main())
@@ -12,6 +12,8 @@ class Settings:
     http_port: int = 8787
     boosters_cache_seconds: int = 300
     role_members_cache_seconds: int = 300
+    members_cache_seconds: int = 300
+    cache_stale_seconds: int = 300
 
 
 def load_settings() -> Settings:
@@ -30,6 +32,10 @@ def load_settings() -> Settings:
     role_members_cache_seconds = int(
         os.getenv("ROLE_MEMBERS_CACHE_SECONDS", str(boosters_cache_seconds)).strip()
     )
+    members_cache_seconds = int(
+        os.getenv("MEMBERS_CACHE_SECONDS", str(boosters_cache_seconds)).strip()
+    )
+    cache_stale_seconds = int(os.getenv("CACHE_STALE_SECONDS", "300").strip())
 
     return Settings(
         discord_bot_token=token,
@@ -38,4 +44,6 @@ def load_settings() -> Settings:
         http_port=port,
         boosters_cache_seconds=boosters_cache_seconds,
         role_members_cache_seconds=role_members_cache_seconds,
+        members_cache_seconds=members_cache_seconds,
+        cache_stale_seconds=cache_stale_seconds,
     )